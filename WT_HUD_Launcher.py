@@ -1,13 +1,17 @@
 import sys
 import traceback
+import importlib.util
 import ctypes
 import threading
 import time
 import math
 import json
 import os
+from collections import deque
 from datetime import datetime
 
+STARTUP_T0 = time.perf_counter()
+
 # --- 核心设置 ---
 UI_SCALE = 1.5
 
@@ -21,15 +25,18 @@ except Exception:
         pass
 
 # --- 库加载 ---
+# 只在启动时加载 tkinter；requests / pygame / keyboard 仅检查是否已安装，
+# 等到真正用到对应功能时才导入 (见下方 get_requests / get_keyboard / get_gamepad)
 print(f"Step 1: 初始化系统 (Scale: {UI_SCALE}x)...")
 try:
     import tkinter as tk
     from tkinter import font, messagebox, simpledialog
-    import requests
-    import pygame
-    import keyboard
 
-    print("运行库加载正常。")
+    missing = [m for m in ("requests", "pygame", "keyboard") if importlib.util.find_spec(m) is None]
+    if missing:
+        raise ImportError(f"No module named {', '.join(missing)}")
+
+    print("运行库检查正常。")
 except ImportError as e:
     try:
         import tkinter as tk
@@ -43,6 +50,7 @@ except ImportError as e:
 
 CONFIG_FILE = "telemetry_config.json"
 HISTORY_FILE = "lap_history.csv"
+SHIFT_LOG_FILE = "shift_latency.csv"
 
 DEFAULT_CONFIG = {
     "rpm_max": 3000,
@@ -53,16 +61,60 @@ DEFAULT_CONFIG = {
     "timer_x": -1, "timer_y": -1,
     "best_lap": 0.0,
     "show_best_lap": True,
+    "show_pedals": True,
+    "shift_predict": False,
+    "shift_display_offset_ms": 17,
     "action_hotkey": "space"
 }
 
 SERVER_URL = "http://127.0.0.1:8111/indicators"
 
+# --- 预测换挡灯 ---
+SHIFT_FIT_SAMPLES = 6  # 拟合转速斜率用的样本数
+SHIFT_FIT_WINDOW = 0.3  # 只拟合最近 0.3 秒内的样本
+SHIFT_MAX_LEAD = 0.25  # 最多提前 0.25 秒
+SHIFT_REPORT_INTERVAL = 1.0  # 每秒输出/记录一次延迟和预测误差
+SHIFT_LOG_LOCK = threading.Lock()
+
 
 def s(value):
     return int(value * UI_SCALE)
 
 
+def ema(avg, value, alpha=0.1):
+    return value if avg == 0.0 else avg + (value - avg) * alpha
+
+
+# --- 延迟加载 ---
+requests = None
+keyboard = None
+gamepad = None
+
+
+def get_requests():
+    """ 第一次轮询遥测数据时才加载 HTTP 库 """
+    global requests
+    if requests is None:
+        import requests
+    return requests
+
+
+def get_keyboard():
+    """ 第一次绑定键盘快捷键时才加载 keyboard """
+    global keyboard
+    if keyboard is None:
+        import keyboard
+    return keyboard
+
+
+def get_gamepad():
+    """ 只有 btnN 快捷键或踏板显示需要时才创建手柄线程 """
+    global gamepad
+    if gamepad is None:
+        gamepad = GamepadReader()
+    return gamepad
+
+
 # --- 手柄读取模块 ---
 class GamepadReader:
     def __init__(self):
@@ -88,7 +140,12 @@ class GamepadReader:
         self.btn_callback = None
 
     def loop(self):
-        pygame.init()
+        os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+        import pygame
+
+        # 不调用 pygame.init()，避免启动音频/字体等无关子系统。
+        # display.init() 不会创建窗口，但 event.pump() 需要它来刷新手柄状态。
+        pygame.display.init()
         pygame.joystick.init()
         while self.running:
             if pygame.joystick.get_count() > 0:
@@ -122,9 +179,6 @@ class GamepadReader:
                 time.sleep(1)
 
 
-gamepad = GamepadReader()
-
-
 # --- 计时器窗口 ---
 class LapTimerWindow:
     def __init__(self, master_root, config):
@@ -203,22 +257,24 @@ class LapTimerWindow:
 
     def setup_hotkey(self):
         raw_key = self.config.get("action_hotkey", "space").lower()
-        try:
-            keyboard.unhook_all()
-        except:
-            pass
-        gamepad.clear_trigger()
+        if keyboard is not None:
+            try:
+                keyboard.unhook_all()
+            except:
+                pass
+        if gamepad is not None:
+            gamepad.clear_trigger()
 
         if raw_key.startswith("btn"):
             try:
                 btn_idx = int(raw_key.replace("btn", ""))
-                gamepad.set_trigger(btn_idx, self.on_hotkey_press)
+                get_gamepad().set_trigger(btn_idx, self.on_hotkey_press)
                 print(f"Timer bound to Gamepad Button {btn_idx}")
             except:
-                keyboard.on_press_key("space", self.on_hotkey_press)
+                get_keyboard().on_press_key("space", self.on_hotkey_press)
         else:
             try:
-                keyboard.on_press_key(raw_key, self.on_hotkey_press)
+                get_keyboard().on_press_key(raw_key, self.on_hotkey_press)
                 print(f"Timer bound to Keyboard {raw_key}")
             except:
                 pass
@@ -314,8 +370,10 @@ class LapTimerWindow:
         return self.root.winfo_x(), self.root.winfo_y()
 
     def close(self):
-        keyboard.unhook_all()
-        gamepad.clear_trigger()
+        if keyboard is not None:
+            keyboard.unhook_all()
+        if gamepad is not None:
+            gamepad.clear_trigger()
         self.root.destroy()
 
 
@@ -363,6 +421,11 @@ class MainHUDWindow:
         self.canvas.bind("<Button-1>", self.start_move)
         self.canvas.bind("<B1-Motion>", self.do_move)
 
+        # 预测换挡灯状态，勾选后才启用 (见 reset_shift_predict)
+        self.rpm_samples = deque(maxlen=SHIFT_FIT_SAMPLES)  # (采样时间, rpm)
+        self.pending_predictions = deque(maxlen=120)  # (目标时间, 预测 rpm, 未补偿 rpm)
+        self.predict_active = False
+
         self.update_loop()
 
     def remove_border(self, event):
@@ -396,9 +459,160 @@ class MainHUDWindow:
             return "#ff00ff"
         return "#ff0000"
 
+    def reset_shift_predict(self):
+        """ 勾选预测换挡灯时清空旧数据，延迟和误差统计从头开始 """
+        self.rpm_samples.clear()
+        self.pending_predictions.clear()
+        self.last_value = None
+        self.last_poll_t = None
+        self.known_t = 0.0  # 最近一次确认数值的时间
+        self.sample_spacing = 0.0  # 服务器数值正常变化的平均间隔 (秒)
+        self.holding = False
+        self.render_delay = 0.0  # 收到数据 -> 画面 的平均延迟 (秒)
+        self.pipeline_delay = 0.0  # 转速变化 -> 画面 的平均端到端延迟 (秒)
+        self.last_frame_t = 0.0
+        self.stats_reset_t = time.perf_counter()
+        self.reset_shift_stats()
+
+    def reset_shift_stats(self):
+        self.err_pred_sum = 0.0
+        self.err_raw_sum = 0.0
+        self.err_count = 0
+        self.lead_sum = 0.0
+        self.lead_count = 0
+        self.lead_capped = 0
+
+    def predict_rpm(self, t_target):
+        """ 对最近的样本做最小二乘直线拟合，外推到 t_target 时刻的转速 """
+        n = len(self.rpm_samples)
+        last_t, last_rpm = self.rpm_samples[-1]
+        if n < 3:
+            return last_rpm
+
+        mean_t = sum(t for t, _ in self.rpm_samples) / n
+        mean_r = sum(r for _, r in self.rpm_samples) / n
+        var_t = sum((t - mean_t) ** 2 for t, _ in self.rpm_samples)
+        if var_t <= 0:
+            return last_rpm
+        slope = sum((t - mean_t) * (r - mean_r) for t, r in self.rpm_samples) / var_t
+        return mean_r + slope * (t_target - mean_t)
+
+    def hold_limit(self):
+        """ 数值保持超过这个时间就认为转速停住了 """
+        return 1.5 * self.sample_spacing if self.sample_spacing > 0 else 0.1
+
+    def score_predictions(self, t_known, actual_at):
+        """ 目标时刻不晚于 t_known 的预测都已经有真实值，计入误差 """
+        while self.pending_predictions and self.pending_predictions[0][0] <= t_known:
+            t_target, pred_rpm, raw_rpm = self.pending_predictions.popleft()
+            actual = actual_at(t_target)
+            self.err_pred_sum += abs(pred_rpm - actual)
+            self.err_raw_sum += abs(raw_rpm - actual)
+            self.err_count += 1
+
+    def record_rpm_sample(self, t_send, t_recv, rpm, gear):
+        """ 记录一次轮询结果，返回是否是数值有变化的新样本 """
+        t_poll = (t_send + t_recv) / 2
+        prev_poll = self.last_poll_t
+        self.last_poll_t = t_poll
+
+        # 服务器刷新比轮询慢时会重复返回同一个值，重复样本会让拟合变成阶梯
+        if (rpm, gear) == self.last_value:
+            # 到这次轮询为止数值都没变，到期的预测按保持值计分
+            self.score_predictions(t_poll, lambda t: rpm)
+            self.known_t = t_poll
+            # 保持时间超过正常变化间隔，说明转速停住了 (断油/定速/暂停)，补一个平的样本
+            if t_poll - self.rpm_samples[-1][0] > self.hold_limit():
+                self.rpm_samples.append((t_poll, rpm))
+                self.holding = True
+            self.trim_rpm_samples(t_poll)
+            return False
+        gear_changed = self.last_value is None or gear != self.last_value[1]
+        prev_rpm = self.last_value[0] if self.last_value else rpm
+        self.last_value = (rpm, gear)
+
+        # 数值在上一次和这一次轮询之间发生变化，取两者中点作为采样时间
+        if prev_poll is None or t_poll - prev_poll > 0.5:
+            t_sample = t_poll
+        else:
+            t_sample = (prev_poll + t_poll) / 2
+
+        if gear_changed:
+            # 换挡时转速跳变，旧样本不能参与拟合
+            self.rpm_samples.clear()
+            self.pending_predictions.clear()
+        else:
+            if not self.holding and t_sample - self.rpm_samples[-1][0] < 0.5:
+                self.sample_spacing = ema(self.sample_spacing, t_sample - self.rpm_samples[-1][0])
+            # 从最后一次确认的值线性过渡到新值，保持阶段已经按平的计过分
+            t0 = self.known_t
+            self.score_predictions(t_sample, lambda t: prev_rpm + (rpm - prev_rpm) * (t - t0) / (t_sample - t0))
+
+        self.known_t = t_sample
+        self.holding = False
+        self.rpm_samples.append((t_sample, rpm))
+        self.trim_rpm_samples(t_poll)
+        return True
+
+    def trim_rpm_samples(self, now):
+        # 按当前时间裁剪，而不是按最后一个样本，停住后拟合才会变平
+        while len(self.rpm_samples) > 1 and self.rpm_samples[0][0] < now - SHIFT_FIT_WINDOW:
+            self.rpm_samples.popleft()
+
+    def display_offset(self):
+        """ 合成器/OBS 采集的额外延迟，程序内测不到，由用户设置 """
+        return max(self.config.get("shift_display_offset_ms", 17), 0) / 1000.0
+
+    def update_pipeline_delay(self, t_recv, is_new, t_drawn):
+        # 画面会一直保留到下一帧，所以平均多出半个帧间隔
+        frame_interval = t_drawn - self.last_frame_t
+        self.last_frame_t = t_drawn
+        if frame_interval > 0.5:
+            return
+        self.render_delay = ema(self.render_delay, (t_drawn - t_recv) + frame_interval / 2)
+        # 端到端延迟只在新样本上测：从转速变化的时刻算起，包含服务器数据本身的陈旧时间
+        if is_new:
+            t_sample = self.rpm_samples[-1][0]
+            delay = (t_drawn - t_sample) + frame_interval / 2 + self.display_offset()
+            self.pipeline_delay = ema(self.pipeline_delay, delay)
+
+    def report_shift_stats(self, now):
+        if now - self.stats_reset_t < SHIFT_REPORT_INTERVAL:
+            return
+        self.stats_reset_t = now
+        if self.err_count == 0:
+            return
+
+        lead_ms = self.lead_sum / self.lead_count * 1000 if self.lead_count else 0.0
+        capped_pct = self.lead_capped / self.lead_count * 100 if self.lead_count else 0.0
+        row = (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), self.pipeline_delay * 1000, self.render_delay * 1000,
+               self.display_offset() * 1000, lead_ms, capped_pct,
+               self.err_pred_sum / self.err_count, self.err_raw_sum / self.err_count, self.err_count)
+        self.reset_shift_stats()
+        # 写文件放到后台线程，不占用界面线程的帧时间
+        threading.Thread(target=self.write_shift_log, args=(row,), daemon=True).start()
+
+    def write_shift_log(self, row):
+        timestamp, delay_ms, render_ms, offset_ms, lead_ms, capped_pct, err_pred, err_raw, count = row
+        print(f"Shift predict: 端到端延迟 {delay_ms:.0f} ms / 绘制 {render_ms:.0f} ms / 显示偏移 {offset_ms:.0f} ms, "
+              f"实际提前 {lead_ms:.0f} ms (封顶 {capped_pct:.0f}%), "
+              f"预测误差 {err_pred:.0f} rpm (未补偿 {err_raw:.0f} rpm)")
+        with SHIFT_LOG_LOCK:
+            try:
+                file_exists = os.path.isfile(SHIFT_LOG_FILE)
+                with open(SHIFT_LOG_FILE, "a", encoding="utf-8") as f:
+                    if not file_exists:
+                        f.write("Timestamp,Pipeline Delay (ms),Render Delay (ms),Display Offset (ms),"
+                                "Applied Lead (ms),Lead Capped (%),Predicted Error (rpm),Raw Error (rpm),Samples\n")
+                    f.write(f"{timestamp},{delay_ms:.1f},{render_ms:.1f},{offset_ms:.1f},{lead_ms:.1f},"
+                            f"{capped_pct:.1f},{err_pred:.1f},{err_raw:.1f},{count}\n")
+            except Exception as e:
+                print(f"Shift log failed: {e}")
+
     def draw_pedals(self):
-        b_val = gamepad.brake
-        t_val = gamepad.throttle
+        pad = get_gamepad()
+        b_val = pad.brake
+        t_val = pad.throttle
         bar_h = s(200)
         fill_h = int(b_val * bar_h)
 
@@ -418,7 +632,10 @@ class MainHUDWindow:
 
     def update_loop(self):
         try:
-            resp = requests.get(SERVER_URL, timeout=0.02)
+            http = get_requests()
+            t_send = time.perf_counter()
+            resp = http.get(SERVER_URL, timeout=0.02)
+            t_recv = time.perf_counter()
             data = resp.json()
             if data['valid']:
                 rpm = data.get('rpm', 0)
@@ -431,6 +648,25 @@ class MainHUDWindow:
                 if rpm_max <= 0: rpm_max = 3000
                 rpm_ratio = min(rpm / rpm_max, 1.0)
 
+                color_ratio = rpm_ratio
+                predict = self.config.get("shift_predict", False)
+                if predict:
+                    if not self.predict_active:
+                        self.reset_shift_predict()
+                    is_new = self.record_rpm_sample(t_send, t_recv, rpm, gear)
+                    # 预测这一帧真正出现在屏幕上时的转速
+                    t_last = self.rpm_samples[-1][0]
+                    t_target = t_recv + self.render_delay + self.display_offset()
+                    if t_target > t_last + SHIFT_MAX_LEAD:
+                        t_target = t_last + SHIFT_MAX_LEAD
+                        self.lead_capped += 1
+                    self.lead_sum += t_target - t_last
+                    self.lead_count += 1
+                    pred_rpm = self.predict_rpm(t_target)
+                    self.pending_predictions.append((t_target, pred_rpm, rpm))
+                    color_ratio = max(0.0, min(pred_rpm / rpm_max, 1.0))
+                self.predict_active = predict
+
                 if gear == neutral:
                     g_txt = "N"
                 elif gear > neutral:
@@ -440,7 +676,7 @@ class MainHUDWindow:
 
                 self.canvas.delete("all")
 
-                bar_col = self.get_bar_color(rpm_ratio)
+                bar_col = self.get_bar_color(color_ratio)
                 segments = 60
                 active = int(segments * rpm_ratio)
                 base_bar_w = 500
@@ -455,7 +691,8 @@ class MainHUDWindow:
                     self.canvas.create_rectangle(x, y, x + (s(base_bar_w) / segments) - 1.5, y + s(25), fill=col,
                                                  outline="")
 
-                self.draw_pedals()
+                if self.config.get("show_pedals", True):
+                    self.draw_pedals()
 
                 self.canvas.create_text(s(240), s(150), text=str(speed), font=self.font_val, fill="white", anchor="e")
                 self.canvas.create_text(s(250), s(190), text="km/h", font=self.font_unit, fill="#aaa", anchor="w")
@@ -475,6 +712,13 @@ class MainHUDWindow:
                     self.canvas.create_text(box_cx, box_y + s(15), text=cc_txt, font=self.font_cc, fill="white")
                     self.canvas.create_text(box_cx, box_y + s(32), text="CC", font=self.font_cc_label, fill="white")
 
+                if predict:
+                    # 强制立即重绘，才能测到真实的绘制完成时间
+                    self.canvas.update_idletasks()
+                    t_drawn = time.perf_counter()
+                    self.update_pipeline_delay(t_recv, is_new, t_drawn)
+                    self.report_shift_stats(t_drawn)
+
         except:
             pass
 
@@ -501,7 +745,7 @@ class ControlPanel:
     def __init__(self):
         self.root = tk.Tk()
         self.root.title("WT TELEMETRY CONTROL")
-        self.root.geometry("400x650")
+        self.root.geometry("400x740")
 
         self.colors = {
             "bg": "#2b2b2b",
@@ -550,6 +794,26 @@ class ControlPanel:
         self.e_flash = self.create_input(row_f, str(self.config.get("rpm_threshold_flash", 96)), 5)
         self.e_flash.pack(side=tk.RIGHT)
 
+        row_o = tk.Frame(f_car, bg=self.colors["panel"])
+        row_o.pack(fill="x", pady=2)
+        tk.Label(row_o, text="显示/采集延迟 (ms):", fg=self.colors["fg"], bg=self.colors["panel"]).pack(side=tk.LEFT)
+        self.e_offset = self.create_input(row_o, str(self.config.get("shift_display_offset_ms", 17)), 5)
+        self.e_offset.pack(side=tk.RIGHT)
+
+        self.v_show_pedals = tk.BooleanVar(value=self.config.get("show_pedals", True))
+        chk_pedals = tk.Checkbutton(f_car, text="显示油门/刹车 (手柄)", variable=self.v_show_pedals,
+                                    command=self.update_config_live,
+                                    bg=self.colors["panel"], fg=self.colors["fg"], selectcolor=self.colors["input"],
+                                    activebackground=self.colors["panel"], activeforeground=self.colors["accent"])
+        chk_pedals.pack(anchor="w", pady=2)
+
+        self.v_predict = tk.BooleanVar(value=self.config.get("shift_predict", False))
+        chk_predict = tk.Checkbutton(f_car, text="预测换挡灯 (延迟补偿)", variable=self.v_predict,
+                                     command=self.update_config_live,
+                                     bg=self.colors["panel"], fg=self.colors["fg"], selectcolor=self.colors["input"],
+                                     activebackground=self.colors["panel"], activeforeground=self.colors["accent"])
+        chk_predict.pack(anchor="w", pady=2)
+
         f_timer = self.create_section("计时器 / TIMER")
         self.v_show_best = tk.BooleanVar(value=self.config["show_best_lap"])
         chk = tk.Checkbutton(f_timer, text="显示历史最快圈 (Show Best)", variable=self.v_show_best,
@@ -598,8 +862,13 @@ class ControlPanel:
             anchor="w", pady=2)
 
         self.root.protocol("WM_DELETE_WINDOW", self.close_app)
+        self.root.after_idle(self.report_startup_time)
         self.root.mainloop()
 
+    def report_startup_time(self):
+        elapsed_ms = (time.perf_counter() - STARTUP_T0) * 1000
+        print(f"Step 2: 控制台已就绪 (启动耗时 {elapsed_ms:.0f} ms)")
+
     def create_section(self, title):
         frame = tk.LabelFrame(self.root, text=title, font=("Arial", 9, "bold"),
                               bg=self.colors["panel"], fg="#aaa", bd=1, relief="flat")
@@ -627,6 +896,8 @@ class ControlPanel:
 
     def update_config_live(self):
         self.config["show_best_lap"] = self.v_show_best.get()
+        self.config["show_pedals"] = self.v_show_pedals.get()
+        self.config["shift_predict"] = self.v_predict.get()
 
     def set_hotkey(self):
         key = simpledialog.askstring("设置按键", "请输入按键:\n\n键盘: space, a, enter\n手柄: btn4 (LB), btn0 (A)...")
@@ -643,6 +914,7 @@ class ControlPanel:
             self.config["rpm_threshold_pink"] = int(self.e_pink.get())
             self.config["rpm_threshold_blue"] = int(self.e_blue.get())
             self.config["rpm_threshold_flash"] = int(self.e_flash.get())
+            self.config["shift_display_offset_ms"] = int(self.e_offset.get())
             self.config["best_lap"] = float(self.e_best.get())
         except ValueError:
             messagebox.showerror("错误", "请输入有效的数字！")
@@ -659,6 +931,7 @@ class ControlPanel:
             self.config["rpm_threshold_pink"] = int(self.e_pink.get())
             self.config["rpm_threshold_blue"] = int(self.e_blue.get())
             self.config["rpm_threshold_flash"] = int(self.e_flash.get())
+            self.config["shift_display_offset_ms"] = int(self.e_offset.get())
             self.config["best_lap"] = float(self.e_best.get())
         except ValueError:
             messagebox.showerror("错误", "请输入有效的数字！")